@@ -36,7 +36,6 @@ import documentinfo
 import plugin
 import tokeniter
 import appinfo
-import codecs
 import job
 import qutil
 import resultfiles
@@ -110,9 +109,7 @@ class AudioExportDialog(externalcommand.ExternalCommandDialog):
     def midi2wav(self, midfile, wavfile):
         """Run timidity to convert the MIDI to WAV."""
         self.wavfile = wavfile # we could need to clean it up...
-        j = job.Job()
-        j.decoder_stdout = j.decoder_stderr = codecs.getdecoder('utf-8')
-        j.command = ["timidity", midfile, "-Ow", "-o", wavfile]
+        j = job.Job(["timidity", midfile, "-Ow", "-o", wavfile])
         self.run_job(j)
 
     def cleanup(self, state):
@@ -149,8 +149,8 @@ class ToLyDialog(QDialog):
             )[0] + '.ly'
         self._job = j = self._job_class(
             command=self._info.toolcommand(self._imp_prgm),
-            input=self._input,
-            output=f'--output={output}',
+            input_file=self._input,
+            output_argument=f'--output={output}',
             directory=os.path.dirname(self._input),
             encoding='utf-8')
         j._output_file = output
@@ -24,11 +24,13 @@ and capture the output to get it later or to have a log follow it.
 
 
 import codecs
+import collections
 import os
-import platform
+import sys
 import time
 
-from PyQt5.QtCore import QCoreApplication, QProcess, QProcessEnvironment
+from PyQt5.QtCore import (
+    QCoreApplication, QProcess, QProcessEnvironment, QTimer)
 
 import signals
 
@@ -49,21 +51,64 @@ STATUS = NEUTRAL | SUCCESS | FAILURE
 # all
 ALL = OUTPUT | STATUS
 
+_IS_WINDOWS = sys.platform == 'win32'
+
+# milliseconds to wait before reading output after the process wrote some
+DRAIN_INTERVAL = 15
+
+
+_system_environment = None
+
+
+def system_environment():
+    """Return a copy of the system environment as a QProcessEnvironment.
+
+    The system environment is only queried once, a copy of the snapshot is
+    returned so that it can be modified by the caller. If os.environ is
+    changed later on, call clear_environment_cache().
+
+    """
+    global _system_environment
+    if _system_environment is None:
+        _system_environment = QProcessEnvironment.systemEnvironment()
+    return QProcessEnvironment(_system_environment)
+
+
+def clear_environment_cache():
+    """Forget the snapshot of the system environment.
+
+    Call this after changing os.environ, so that jobs pick up the change.
+
+    """
+    global _system_environment
+    _system_environment = None
+
 
 class Job:
     """Manages a process.
 
-    Set the command attribute to a list of strings describing the program and
-    its arguments.
+    Give the command as a list of strings describing the program and its
+    arguments on construction; the full command line is composed from it in
+    configure_command() and stored in the command attribute on start().
     Set the directory attribute to a working directory.
     The environment attribute is a dictionary; if you set an item it will be
     added to the environment for the process (the rest will be inherited from
-    the system); if you set an item to None, it will be unset.
+    the system); if you set an item to None, it will be unset. The add_env()
+    and remove_env() methods do the same.
 
     Call start() to start the process.
     The output() signal emits output (stderr or stdout) from the process.
+    The output_batch() signal emits all output from the process that was read
+    in one go as a list of (text, type) tuples. Every STDOUT and STDERR message
+    is emitted both by output() and (as part of a batch) by output_batch(), so
+    connect to only one of the two for STDOUT and STDERR messages.
     The done() signal is always emitted when the process has ended.
     The history() method returns all status messages and output so far.
+    If merge_channels is True, the process' stderr is merged into its stdout
+    and all output is reported as STDOUT. Jobs that need to parse stderr
+    separately (like LilyPond jobs) must keep the default (False).
+    If history_max is given, only the last history_max messages are kept in
+    the history; stdout() and stderr() always return the full output.
 
     When the process has finished, the error and success attributes are set.
     The success attribute is set to True When the process exited normally and
@@ -83,6 +128,7 @@ class Job:
 
     """
     output = signals.Signal()
+    output_batch = signals.Signal() # list of (text, type) tuples
     done = signals.Signal()
     started = signals.Signal()
     title_changed = signals.Signal() # title (string)
@@ -90,22 +136,30 @@ class Job:
     def __init__(self,
         command="",
         args=None,
+        *,
         directory="",
         environment=None,
         title="",
-        input="",
-        output="",
+        input_file="",
+        output_argument="",
         priority=1,
         runner=None,
-        decode_errors='strict',
-        encoding='latin1'):
-        self.command = list(command) if isinstance(command, (list, tuple)) else [command]
-        self._input = input
-        self._output = output
+        decode_errors='replace',
+        encoding='utf-8',
+        history_max=None,
+        merge_channels=False):
+        self._base_command = (command,) if isinstance(command, str) else tuple(command)
+        self.command = []   # composed in configure_command()
+        self._command_dirty = True
+        self._built_command = ()
+        self._input = input_file
+        self._output = output_argument
         self._runner = runner
-        self._arguments = args if args else []
+        self._arguments = list(args) if args else []
+        self._arguments_set = set(self._arguments)
         self._directory = directory
         self.environment = environment or {}
+        self._cached_environment = None # (environment, snapshot, QProcessEnvironment)
         self._encoding = encoding
         self.success = None
         self.error = None
@@ -113,24 +167,31 @@ class Job:
         self._priority = priority
         self._aborted = False
         self._process = None
-        self._history = []
-        self._starttime = 0.0
+        self._drain_pending = False
+        self._merge_channels = merge_channels
+        self._history_max = history_max
+        self._clear_history()
+        self._starttime = 0.0       # wall clock time, see start_time()
+        self._starttime_mono = 0.0  # for measuring the elapsed time
         self._elapsed = 0.0
+        self.decode_errors = decode_errors  # codecs error handling
         self.decoder_stdout = self.create_decoder(STDOUT)
         self.decoder_stderr = self.create_decoder(STDERR)
-        self.decode_errors = decode_errors  # codecs error handling
 
     def add_argument(self, arg):
         """Append an additional command line argument if it is not
         present already."""
-        if not arg in self._arguments:
+        if arg not in self._arguments_set:
+            self._arguments_set.add(arg)
             self._arguments.append(arg)
+            self._command_dirty = True
 
     def arguments(self):
         """Additional (custom) arguments, will be inserted between
         the -d options and the include paths. May for example stem
-        from the manual part of the Engrave Custom dialog."""
-        return self._arguments
+        from the manual part of the Engrave Custom dialog.
+        Returned as a tuple; use add_argument() to add arguments."""
+        return tuple(self._arguments)
 
     def create_decoder(self, channel):
         """Return a decoder for the given channel (STDOUT/STDERR).
@@ -141,11 +202,13 @@ class Job:
         construction.
 
         This decoder is then used to decode the 8bit bytestrings into Python
-        unicode strings. The default implementation returns a 'latin1'
-        decoder for both channels.
+        unicode strings. It must be an incremental decoder, so that multibyte
+        sequences split over two reads are decoded correctly. The default
+        implementation returns an incremental decoder for the job's encoding
+        (by default 'utf-8'), using the decode_errors error handling.
 
         """
-        return codecs.getdecoder(self._encoding)
+        return codecs.getincrementaldecoder(self._encoding)(self.decode_errors)
 
     def directory(self):
         return self._directory
@@ -160,6 +223,7 @@ class Job:
 
     def set_input(self, filename):
         self._input = filename
+        self._command_dirty = True
 
     def set_input_file(self):
         """configure the command to add an input file if one is specified."""
@@ -213,9 +277,12 @@ class Job:
         self.success = None
         self.error = None
         self._aborted = False
-        self._history = []
+        self._clear_history()
+        self.decoder_stdout.reset()
+        self.decoder_stderr.reset()
         self._elapsed = 0.0
         self._starttime = time.time()
+        self._starttime_mono = time.monotonic()
         if self._process is None:
             self.set_process(QProcess())
         self._process.started.connect(self.started)
@@ -224,7 +291,9 @@ class Job:
             self._process.setWorkingDirectory(self._directory)
         if self.environment:
             self._update_process_environment()
-        self._process.start(self.command[0], self.command[1:])
+        self._process.setProgram(self.command[0])
+        self._process.setArguments(self.command[1:])
+        self._process.start()
 
     def configure_command(self):
         """Process the command if necessary.
@@ -232,23 +301,33 @@ class Job:
         the command line from the job options.
         This implementation simply creates a list from the main
         command, any present arguments, the input and the output
-        (if present).
+        (if present). The composed command line is kept as a tuple and only
+        built again when the arguments or the input changed since the
+        previous start(); the command attribute gets a fresh list each time.
         """
-        self.command.extend(self._arguments)
-        if self._input:
-            if type(self._input) == list:
-                self.command.extend(self._input)
-            else:
-                self.command.append(self._input)
-        if self._output:
-            if type(self._output) == list:
-                self.command.extend(self._output)
-            else:
-                self.command.append(self._output)
+        if self._command_dirty:
+            self._command_dirty = False
+            cmd = [*self._base_command, *self._arguments]
+            if self._input:
+                cmd += self._input if isinstance(self._input, list) else (self._input,)
+            if self._output:
+                cmd += self._output if isinstance(self._output, list) else (self._output,)
+            self._built_command = tuple(cmd)
+        self.command = list(self._built_command)
+
+    def _name(self):
+        """(internal) Return the name to display for this job in messages.
+
+        This is the title, or the name of the program if there is no title.
+
+        """
+        return self.title() or os.path.basename(self.command[0])
 
     def start_time(self):
         """Return the time this job was started.
 
+        This is a wall clock time (as returned by time.time()), so it can be
+        compared with file modification times.
         Returns 0.0 when the job has not been started yet.
 
         """
@@ -259,7 +338,7 @@ class Job:
         if self._elapsed:
             return self._elapsed
         elif self._starttime:
-            return time.time() - self._starttime
+            return time.monotonic() - self._starttime_mono
         return 0.0
 
     def abort(self):
@@ -267,7 +346,7 @@ class Job:
         if self._process:
             self._aborted = True
             self.abort_message()
-            if platform.system() == "Windows":
+            if _IS_WINDOWS:
                 self._process.kill()
             else:
                 self._process.terminate()
@@ -295,45 +374,104 @@ class Job:
             process.setParent(QCoreApplication.instance())
         process.finished.connect(self._finished)
         process.error.connect(self._error)
-        process.readyReadStandardError.connect(self._readstderr)
-        process.readyReadStandardOutput.connect(self._readstdout)
+        if self._merge_channels:
+            process.setProcessChannelMode(QProcess.MergedChannels)
+        else:
+            process.readyReadStandardError.connect(self._schedule_drain)
+        process.readyReadStandardOutput.connect(self._schedule_drain)
+
+    def add_env(self, name, value):
+        """Set the environment variable name to value for the process."""
+        self.environment[name] = value
+        self._cached_environment = None
+
+    def remove_env(self, name):
+        """Unset the environment variable name for the process."""
+        self.environment[name] = None
+        self._cached_environment = None
 
     def _update_process_environment(self):
-        """(internal) initializes the environment for the process."""
-        se = QProcessEnvironment.systemEnvironment()
-        for k, v in self.environment.items():
-            se.remove(k) if v is None else se.insert(k, v)
-        self._process.setProcessEnvironment(se)
+        """(internal) initializes the environment for the process.
+
+        The QProcessEnvironment is built once and reused when the job is
+        started again, as long as the environment did not change.
+
+        """
+        cached = self._cached_environment
+        if (cached is None or cached[0] != self.environment
+                or cached[1] is not _system_environment):
+            se = system_environment()
+            for k, v in self.environment.items():
+                se.remove(k) if v is None else se.insert(k, v)
+            cached = self._cached_environment = (
+                dict(self.environment), _system_environment, se)
+        self._process.setProcessEnvironment(cached[2])
+
+    def _clear_history(self):
+        """(internal) Clears the history, called on construction and start()."""
+        maxlen = self._history_max
+        self._history = collections.deque(maxlen=maxlen)
+        # output is not bounded by history_max, so stdout() and stderr()
+        # are complete
+        self._history_by_type = {
+            STDOUT: collections.deque(),
+            STDERR: collections.deque(),
+            NEUTRAL: collections.deque(maxlen=maxlen),
+            SUCCESS: collections.deque(maxlen=maxlen),
+            FAILURE: collections.deque(maxlen=maxlen),
+        }
 
     def message(self, text, type=NEUTRAL):
-        """Output some text as the given type (NEUTRAL, SUCCESS, FAILURE, STDOUT or STDERR)."""
+        """Output some text as the given type (NEUTRAL, SUCCESS, FAILURE, STDOUT or STDERR).
+
+        STDOUT and STDERR messages are also emitted with output_batch().
+
+        """
+        self._add_message(text, type)
+        if type & OUTPUT:
+            self.output_batch([(text, type)])
+
+    def _add_message(self, text, type):
+        """(internal) Emits the message with output() and stores it in the history."""
         self.output(text, type)
         self._history.append((text, type))
+        self._history_by_type[type].append(text)
 
     def history(self, types=ALL):
         """Yield the output messages as two-tuples (text, type) since the process started.
 
+        If the job was created with a history_max value, only the most
+        recent messages are yielded.
+
         If types is given, it should be an OR-ed combination of the status types
         STDERR, STDOUT, NEUTRAL, SUCCESS or FAILURE.
 
         """
-        for msg, type in self._history:
-            if type & types:
-                yield msg, type
+        if self._history_max is None and types in self._history_by_type:
+            for msg in self._history_by_type[types]:
+                yield msg, types
+        else:
+            for msg, type in self._history:
+                if type & types:
+                    yield msg, type
 
     def stdout(self):
         """Return the standard output of the process as unicode text."""
-        return "".join([line[0] for line  in self.history(STDOUT)])
+        return "".join(self._history_by_type[STDOUT])
 
     def stderr(self):
         """Return the standard error of the process as unicode text."""
-        return "".join([line[0] for line in self.history(STDERR)])
+        return "".join(self._history_by_type[STDERR])
 
     def _finished(self, exitCode, exitStatus):
         """(internal) Called when the process has finished."""
-        self.finish_message(exitCode, exitStatus)
-        success = exitCode == 0 and exitStatus == QProcess.NormalExit
-        self._bye(success)
+        try:
+            self._drain()
+            self._flush_decoders()
+        finally:
+            self.finish_message(exitCode, exitStatus)
+            success = exitCode == 0 and exitStatus == QProcess.NormalExit
+            self._bye(success)
 
     def _error(self, error):
         """(internal) Called when an error occurs."""
@@ -343,7 +481,7 @@ class Job:
 
     def _bye(self, success):
         """(internal) Ends and emits the done() signal."""
-        self._elapsed = time.time() - self._starttime
+        self._elapsed = time.monotonic() - self._starttime_mono
         if not success:
             self.error = self._process.error()
         self.success = success
@@ -351,15 +489,82 @@ class Job:
         self._process = None
         self.done(success)
 
+    def _schedule_drain(self):
+        """(internal) Called when STDOUT or STDERR can be read.
+
+        Reading is postponed a little, so that output arriving in quick
+        succession is collected and read in one go by _drain().
+
+        """
+        if not self._drain_pending:
+            self._drain_pending = True
+            QTimer.singleShot(DRAIN_INTERVAL, self._drain)
+
+    def _drain(self):
+        """(internal) Reads all pending output from STDOUT and STDERR."""
+        self._drain_pending = False
+        if self._process is None:
+            return
+        channels = [(self._readstdout, self.decoder_stdout, STDOUT)]
+        if not self._merge_channels:
+            channels.append((self._readstderr, self.decoder_stderr, STDERR))
+        messages, errors = [], []
+        for read, decoder, type in channels:
+            try:
+                messages.append((read(), type))
+            except UnicodeDecodeError as e:
+                errors.append((decoder, e))
+        self._output_messages(messages)
+        for decoder, e in errors:
+            self._decode_failed(decoder, e)
+
+    def _decode_failed(self, decoder, error):
+        """(internal) Called when output from the process could not be decoded.
+
+        Resets the decoder and outputs a FAILURE message.
+
+        """
+        decoder.reset()
+        self.message(_("Could not decode the output of the process: {error}").format(
+            error=error), FAILURE)
+
+    def _flush_decoders(self):
+        """(internal) Outputs text still pending in the decoders."""
+        messages, errors = [], []
+        for decoder, type in (
+                (self.decoder_stdout, STDOUT),
+                (self.decoder_stderr, STDERR)):
+            try:
+                messages.append((decoder.decode(b'', final=True), type))
+            except UnicodeDecodeError as e:
+                errors.append((decoder, e))
+        self._output_messages(messages)
+        for decoder, e in errors:
+            self._decode_failed(decoder, e)
+
+    def _output_messages(self, messages):
+        """(internal) Outputs the non-empty (text, type) tuples in messages.
+
+        Every message is emitted with output() and stored in the history,
+        after that the list of messages is emitted at once using the
+        output_batch() signal.
+
+        """
+        batch = [(text, type) for text, type in messages if text]
+        if batch:
+            for text, type in batch:
+                self._add_message(text, type)
+            self.output_batch(batch)
+
     def _readstderr(self):
-        """(internal) Called when STDERR can be read."""
+        """(internal) Reads and returns STDERR text, called by _drain()."""
         output = self._process.readAllStandardError()
-        self.message(self.decoder_stderr(output, self.decode_errors)[0], STDERR)
+        return self.decoder_stderr.decode(output.data(), final=False)
 
     def _readstdout(self):
-        """(internal) Called when STDOUT can be read."""
+        """(internal) Reads and returns STDOUT text, called by _drain()."""
         output = self._process.readAllStandardOutput()
-        self.message(self.decoder_stdout(output, self.decode_errors)[0], STDOUT)
+        return self.decoder_stdout.decode(output.data(), final=False)
 
     def start_message(self):
         """Called by start().
@@ -367,8 +572,7 @@ class Job:
         Outputs a message that the process has started.
 
         """
-        name = self.title() or os.path.basename(self.command[0])
-        self.message(_("Starting {job}...").format(job=name), NEUTRAL)
+        self.message(_("Starting {job}...").format(job=self._name()), NEUTRAL)
 
     def abort_message(self):
         """Called by abort().
@@ -376,8 +580,7 @@ class Job:
         Outputs a message that the process has been aborted.
 
         """
-        name = self.title() or os.path.basename(self.command[0])
-        self.message(_("Aborting {job}...").format(job=name), NEUTRAL)
+        self.message(_("Aborting {job}...").format(job=self._name()), NEUTRAL)
 
     def error_message(self, error):
         """Called when there is an error (by _error()).
@@ -411,7 +614,8 @@ class Job:
     @staticmethod
     def elapsed2str(seconds):
         """Return a short display for the given time period (in seconds)."""
-        minutes, seconds = divmod(seconds, 60)
-        if minutes:
-            return f"{minutes:.0f}'{seconds:.0f}\""
-        return f'{seconds:.1f}"'
+        if seconds < 60:
+            return f'{seconds:.1f}"'
+        minutes = int(seconds // 60)
+        seconds -= minutes * 60
+        return f"{minutes}'{seconds:.0f}\""
@@ -99,7 +99,7 @@ class LilyPondJob(Job):
         super().__init__(
                 encoding='utf-8',
                 args=args,
-                input=input,
+                input_file=input,
                 decode_errors='replace',
                 directory=directory,
                 environment=(
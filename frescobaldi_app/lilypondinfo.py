@@ -204,6 +204,7 @@ class LilyPondInfo:
                 if exe:
                     bindir = os.path.dirname(exe)
                     os.environ['PATH'] = bindir + ':' + os.environ['PATH']
+                    job.clear_environment_cache()
         else:
             path = None
         return util.findexe(self.command, path) or False
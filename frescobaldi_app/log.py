@@ -60,12 +60,14 @@ class Log(QTextBrowser):
         """Gives us the output from the Job (past and upcoming)."""
         for msg, type in j.history():
             self.write(msg, type)
-        j.output.connect(self.write)
+        j.output.connect(self.writeStatus)
+        j.output_batch.connect(self.writeBatch)
 
     def disconnectJob(self, j):
         """Disconnects from an aborted job
         (to avoid calling into a destroyed log widget)."""
-        j.output.disconnect(self.write)
+        j.output.disconnect(self.writeStatus)
+        j.output_batch.disconnect(self.writeBatch)
 
     def textFormat(self, type):
         """Returns a QTextFormat() for the given type."""
@@ -77,17 +79,45 @@ class Log(QTextBrowser):
         The keepScrolledDown context manager is used to scroll the log further
         down if it was scrolled down at that moment.
 
+        """
+        if type & self._types:
+            with self.keepScrolledDown():
+                self.insertMessage(message, type)
+
+    def writeStatus(self, message, type):
+        """Writes a status message, output is written by writeBatch()."""
+        if type & job.STATUS:
+            self.write(message, type)
+
+    def writeBatch(self, batch):
+        """Writes a list of (message, type) tuples from the Job to the log.
+
+        The messages are inserted in one edit block, so the document layout
+        is updated only once.
+
+        """
+        batch = [(message, type) for message, type in batch if type & self._types]
+        if batch:
+            with self.keepScrolledDown():
+                self.cursor.beginEditBlock()
+                try:
+                    for message, type in batch:
+                        self.insertMessage(message, type)
+                finally:
+                    self.cursor.endEditBlock()
+
+    def insertMessage(self, message, type):
+        """Inserts the message, preceded by a newline if needed.
+
         If two messages of a different type are written after each other a newline
         is inserted if otherwise the message would continue on the same line.
 
         """
-        if type & self._types:
-            with self.keepScrolledDown():
-                changed = type != self._lasttype
-                self._lasttype = type
-                if changed and self.cursor.block().text() and not message.startswith('\n'):
-                    self.cursor.insertText('\n')
-                self.writeMessage(message, type)
+        changed = type != self._lasttype
+        self._lasttype = type
+        if changed and self.cursor.block().text() and not message.startswith('\n'):
+            self.cursor.insertText('\n')
+        self.writeMessage(message, type)
 
     def writeMessage(self, message, type):
         """Inserts the given message in the text with the textformat belonging to type."""
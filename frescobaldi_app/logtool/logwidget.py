@@ -75,7 +75,7 @@ class LogWidget(log.Log):
             if prevDoc and prevDoc != doc:
                 prevJob = job.manager.job(prevDoc)
                 if prevJob:
-                    prevJob.output.disconnect(self.write)
+                    self.disconnectJob(prevJob)
             self._document = weakref.ref(doc)
             self.clear()
             self.connectJob(j)
@@ -75,6 +75,8 @@ def init():
     app.aboutToQuit.connect(server.close)
     server.newConnection.connect(slot_new_connection)
     os.environ["FRESCOBALDI_SOCKET"] = name
+    import job
+    job.clear_environment_cache()
     _server = server
 
 